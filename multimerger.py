@@ -1,98 +1,370 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
+import hashlib
 import os
+import re
+import shelve
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import orjson
 import requests
-from typing import Dict, List, Optional, Any
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from typing import Dict, Iterable, Iterator, List, MutableMapping, Optional, Any, Tuple
+from urllib3.util.retry import Retry
 
 
-def colorize_diff(diff_text: str) -> str:
-    """Add ANSI color codes to diff text"""
-    lines = diff_text.split('\n')
-    colored_lines = []
+CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'multimerger')
+HTTP_CACHE_PATH = os.path.join(CACHE_DIR, 'http')
+DIGEST_CACHE_PATH = os.path.join(CACHE_DIR, 'digests')
+
+# Below this many remaining core requests, responses start spacing out the rest of the budget
+RATE_LIMIT_THRESHOLD = 50
+
+# Bump whenever diff_digest changes so persisted digests from older runs are ignored
+DIGEST_VERSION = 3
+
+# Expected format: https://github.com/owner/repo/pull/123
+_PR_URL_RE = re.compile(r'^https?://github\.com/([^/]+)/([^/]+)/pull/(\d+)/?$')
+
+# Captures the source start, source length and section heading of a hunk header
+_HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@(.*)$')
+
+# Longer prefixes come first so file headers win over plain added/removed lines
+_DIFF_LINE_RE = re.compile(r'^(\+\+\+|---|@@|\+|-).*$', re.MULTILINE)
+_DIFF_COLORS = {
+    '+++': '1',   # File headers in bold
+    '---': '1',
+    '@@': '36',   # Hunk headers in cyan
+    '+': '32',    # Added lines in green
+    '-': '31',    # Removed lines in red
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_pr_url(pr_url: str) -> Tuple[str, str, str]:
+    """Split a GitHub PR URL into (owner, repo, number)"""
+    match = _PR_URL_RE.match(pr_url)
+    if not match:
+        raise ValueError("Invalid GitHub PR URL format")
+    
+    return match.group(1), match.group(2), match.group(3)
+
+
+def diff_digest(lines: Iterable[str]) -> bytes:
+    """Hash the structure of a diff: per-file headers and hunks
+    
+    File order, index lines and absolute hunk offsets don't affect the digest, so the
+    same change applied on top of slightly shifted bases matches. Context lines, hunk
+    section headings and the gaps between hunks are kept to anchor where the change is.
+    """
+    # Each file is hashed separately as it streams past; only the per-file digests are kept
+    file_digests: Dict[str, bytes] = {}
+    file_header: Optional[str] = None
+    file_digest = None
+    previous_hunk_end: Optional[int] = None
+    in_hunk = False
     
     for line in lines:
-        if line.startswith('+++') or line.startswith('---'):
-            # File headers in bold
-            colored_lines.append(f'\033[1m{line}\033[0m')
+        if line.startswith('diff --git '):
+            if file_header is not None:
+                file_digests[file_header] = file_digest.digest()
+            file_header = line.rstrip()
+            file_digest = hashlib.blake2b(digest_size=32)
+            previous_hunk_end = None
+            in_hunk = False
+        elif file_header is None:
+            # Anything before the first file header isn't part of the diff
+            continue
         elif line.startswith('@@'):
-            # Hunk headers in cyan
-            colored_lines.append(f'\033[36m{line}\033[0m')
-        elif line.startswith('+'):
-            # Added lines in green
-            colored_lines.append(f'\033[32m{line}\033[0m')
-        elif line.startswith('-'):
-            # Removed lines in red
-            colored_lines.append(f'\033[31m{line}\033[0m')
+            in_hunk = True
+            match = _HUNK_HEADER_RE.match(line)
+            if not match:
+                file_digest.update(line.rstrip().encode() + b'\n')
+                continue
+            
+            # Replace the absolute offset by the distance from the previous hunk
+            source_start = int(match.group(1))
+            source_length = int(match.group(2) or 1)
+            gap = '' if previous_hunk_end is None else str(source_start - previous_hunk_end)
+            previous_hunk_end = source_start + source_length
+            file_digest.update(f'@@ {gap} @@{match.group(3).rstrip()}\n'.encode())
+        elif in_hunk:
+            # Git writes blank context as ' ', so an empty line is just the end of the text
+            if line:
+                file_digest.update(line.encode() + b'\n')
         else:
-            # Context lines unchanged
-            colored_lines.append(line)
+            # Index lines carry blob hashes that differ between otherwise identical changes
+            parts = line.split()
+            if not (len(parts) >= 2 and parts[0] == 'index' and '..' in parts[1]):
+                file_digest.update(line.rstrip().encode() + b'\n')
+    
+    if file_header is not None:
+        file_digests[file_header] = file_digest.digest()
+    
+    digest = hashlib.blake2b(digest_size=32)
+    for file_header in sorted(file_digests):
+        digest.update(file_header.encode() + b'\n' + file_digests[file_header])
     
-    return '\n'.join(colored_lines)
+    return digest.digest()
+
+
+def colorize_diff(diff_text: str) -> str:
+    """Add ANSI color codes to diff text"""
+    return _DIFF_LINE_RE.sub(lambda m: f'\033[{_DIFF_COLORS[m.group(1)]}m{m.group(0)}\033[0m', diff_text)
+
+
+class Throttle:
+    """Space out calls across threads so that at most one starts per interval"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+    
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _RateLimitRetry(Retry):
+    """Retry that also resends mutations when GitHub answers 429
+    
+    A 429 means the request was rejected without being applied, so resending is
+    safe for any method, unlike a 5xx or a dropped connection mid-response.
+    """
+    
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
 
 
 class GitHubAPIClient:
-    def __init__(self, token: Optional[str] = None):
+    def __init__(self, token: Optional[str] = None, use_cache: bool = True):
         self.token = token or os.getenv('GITHUB_TOKEN')
         if not self.token:
             raise ValueError("GitHub token required. Set GITHUB_TOKEN environment variable.")
         
         self.base_url = 'https://api.github.com'
-        self.session = requests.Session()
+        if use_cache:
+            # Cache GET responses on disk and revalidate them with ETag/Last-Modified,
+            # so re-runs get cheap 304s for unchanged diffs. Accept is part of the key
+            # because the same PR endpoint serves both JSON and diff representations.
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self.session = CachedSession(
+                HTTP_CACHE_PATH,
+                backend='sqlite',
+                cache_control=True,
+                expire_after=3600,
+                match_headers=['Accept'],
+            )
+        else:
+            self.session = requests.Session()
+        
+        # Pool sized above the worker counts so concurrent requests reuse connections,
+        # and transient rate-limit/server errors are retried with exponential backoff.
+        # Server errors are only retried for reads: a 5xx after GitHub already applied
+        # an approve or merge would otherwise post a second review or fail a merged PR.
+        retry = _RateLimitRetry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        self.session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry))
+        
+        # GraphQL queries are POSTs but read-only, so they get the full retry policy
+        graphql_retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False,
+        )
+        self.session.mount(f'{self.base_url}/graphql', HTTPAdapter(max_retries=graphql_retry))
         self.session.headers.update({
             'Authorization': f'token {self.token}',
             'Accept': 'application/vnd.github.v3+json'
         })
+        self.session.hooks['response'].append(self._respect_rate_limit)
+    
+    def __enter__(self) -> 'GitHubAPIClient':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        """Close pooled connections and the cache backend, if any"""
+        self.session.close()
+    
+    def _respect_rate_limit(self, response: requests.Response, *args, **kwargs) -> None:
+        """Back off when a live response reports the core rate limit is nearly exhausted"""
+        # CachedSession dispatches response hooks a second time; only act once per response
+        if getattr(response, '_rate_limit_checked', False):
+            return
+        response._rate_limit_checked = True
+        
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if getattr(response, 'from_cache', False) or remaining is None or reset is None:
+            return
+        
+        # Search and GraphQL have their own, much smaller budgets that the threshold doesn't apply to
+        if response.headers.get('X-RateLimit-Resource', 'core') != 'core':
+            return
+        
+        remaining = int(remaining)
+        if remaining >= RATE_LIMIT_THRESHOLD:
+            return
+        
+        # Spread what is left of the budget evenly over the time until it resets
+        delay = max(0.0, int(reset) - time.time()) / max(remaining, 1)
+        if delay >= 1:
+            print(f"⚠️  Rate limit nearly exhausted ({remaining} requests left), waiting {delay:.0f}s")
+        time.sleep(delay)
     
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Any:
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        if 'json' in kwargs:
+            kwargs['data'] = orjson.dumps(kwargs.pop('json'))
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Type': 'application/json'}
+        
         response = self.session.request(method, url, **kwargs)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
+    
+    def get_rate_limit(self) -> Dict[str, Any]:
+        # Always ask GitHub directly; a cached budget would be meaningless
+        return self._make_request('GET', 'rate_limit', headers={'Cache-Control': 'no-store'})['resources']
     
     def search_assigned_prs(self, title_prefix: str, assignee:str)  -> List[Dict[str, Any]]:
         query = f'is:pr is:open assignee:{assignee}'
         
-        response = self._make_request('GET', 'search/issues', params={'q': query})
+        # Narrow the search server-side by the words of the prefix. GitHub matches whole
+        # words only, so unless the prefix ends in whitespace its last word may be cut
+        # short (e.g. "4." of "4.17.21") and is left to the local filter.
+        words = title_prefix.replace('"', ' ').split()
+        if words and not title_prefix[-1].isspace():
+            words.pop()
+        if words:
+            query += f' "{" ".join(words)}" in:title'
+        
+        prs = []
+        incomplete_results = False
+        per_page = 100
+        page = 1
+        
+        while True:
+            response = self._make_request('GET', 'search/issues', params={'q': query, 'per_page': per_page, 'page': page})
+            items = response.get('items', [])
+            incomplete_results = incomplete_results or response['incomplete_results']
+            
+            # Filter by title prefix
+            prs.extend(pr for pr in items if pr['title'].startswith(title_prefix))
+            
+            # The search API serves at most the first 1000 results
+            if len(items) < per_page or page * per_page >= min(response['total_count'], 1000):
+                break
+            page += 1
         
         # Check for incomplete results and warn user
-        if response['incomplete_results']:
+        if incomplete_results:
             print("⚠️  Warning: Search results may be incomplete due to GitHub API limitations")
         
-        # Filter by title prefix
-        return [pr for pr in response.get('items', []) if pr['title'].startswith(title_prefix)]
+        return prs
     
-    def get_pr_diff(self, pr_url: str) -> str:
-        # Parse GitHub PR URL to extract owner, repo, and PR number
-        # Expected format: https://github.com/owner/repo/pull/123
-        parts = pr_url.rstrip('/').split('/')
-        if len(parts) < 7 or 'github.com' not in pr_url or 'pull' not in parts:
-            raise ValueError("Invalid GitHub PR URL format")
-        
-        owner = parts[-4]
-        repo = parts[-3]
-        pr_number = parts[-1]
-        
-        # Get PR diff using GitHub API
-        endpoint = f'repos/{owner}/{repo}/pulls/{pr_number}'
+    def _get_diff_response(self, pr_url: str, stream: bool = False) -> requests.Response:
+        owner, repo, pr_number = _parse_pr_url(pr_url)
+        
+        # Get PR diff using GitHub API; the session merges its own headers with this override
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
         headers = {'Accept': 'application/vnd.github.v3.diff'}
+        if stream:
+            # Saving to the HTTP cache reads the whole body up front, which would defeat streaming
+            headers['Cache-Control'] = 'no-store'
         
-        url = f"{self.base_url}/{endpoint}"
-        response = self.session.get(url, headers={**self.session.headers, **headers})
+        response = self.session.get(url, headers=headers, stream=stream)
         response.raise_for_status()
         
-        return response.text
+        return response
     
-    def approve_pr(self, pr_url: str) -> None:
-        # Parse GitHub PR URL to extract owner, repo, and PR number
-        parts = pr_url.rstrip('/').split('/')
-        if len(parts) < 7 or 'github.com' not in pr_url or 'pull' not in parts:
-            raise ValueError("Invalid GitHub PR URL format")
+    def get_pr_diff(self, pr_url: str) -> str:
+        return self._get_diff_response(pr_url).text
+    
+    def iter_pr_diff_lines(self, pr_url: str) -> Iterator[str]:
+        """Stream a PR diff line by line without holding the whole body in memory"""
+        with self._get_diff_response(pr_url, stream=True) as response:
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            
+            partial_line = ''
+            for chunk in response.iter_content(chunk_size=65536, decode_unicode=True):
+                lines = (partial_line + chunk).split('\n')
+                partial_line = lines.pop()
+                yield from lines
+            
+            yield partial_line
+    
+    def get_pr_summaries(self, pr_urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch head SHA and per-file (path, additions, deletions) for many PRs via batched GraphQL queries
+        
+        Each PR maps to {'head_sha': ..., 'file_stats': ...}; values that could not be
+        fetched completely are None.
+        """
+        summaries: Dict[str, Dict[str, Any]] = {}
+        batch_size = 50
+        
+        for start in range(0, len(pr_urls), batch_size):
+            batch = pr_urls[start:start + batch_size]
+            variable_defs = []
+            fields = []
+            variables: Dict[str, Any] = {}
+            
+            for i, pr_url in enumerate(batch):
+                owner, repo, pr_number = _parse_pr_url(pr_url)
+                variables.update({f'owner{i}': owner, f'repo{i}': repo, f'number{i}': int(pr_number)})
+                variable_defs.append(f'$owner{i}: String!, $repo{i}: String!, $number{i}: Int!')
+                fields.append(
+                    f'pr{i}: repository(owner: $owner{i}, name: $repo{i}) {{ '
+                    f'pullRequest(number: $number{i}) {{ headRefOid '
+                    f'files(first: 100) {{ totalCount nodes {{ path additions deletions }} }} }} }}'
+                )
+            
+            query = f"query({', '.join(variable_defs)}) {{ {' '.join(fields)} }}"
+            response = self._make_request('POST', 'graphql', json={'query': query, 'variables': variables})
+            
+            # A failed batch just leaves its PRs unknown; they fall back to comparing diffs
+            data = response.get('data') or {}
+            
+            for i, pr_url in enumerate(batch):
+                pull_request = (data.get(f'pr{i}') or {}).get('pullRequest') or {}
+                files = pull_request.get('files')
+                file_stats = None
+                
+                # Anything partial is unknown, so the caller falls back to comparing diffs
+                if files and files['totalCount'] <= len(files['nodes']):
+                    file_stats = tuple(sorted(
+                        (node['path'], node['additions'], node['deletions']) for node in files['nodes']
+                    ))
+                
+                summaries[pr_url] = {'head_sha': pull_request.get('headRefOid'), 'file_stats': file_stats}
         
-        owner = parts[-4]
-        repo = parts[-3]
-        pr_number = parts[-1]
+        return summaries
+    
+    def approve_pr(self, pr_url: str) -> None:
+        owner, repo, pr_number = _parse_pr_url(pr_url)
         
         # Create approval review
         endpoint = f'repos/{owner}/{repo}/pulls/{pr_number}/reviews'
@@ -104,14 +376,7 @@ class GitHubAPIClient:
         self._make_request('POST', endpoint, json=data)
     
     def merge_pr(self, pr_url: str, merge_method: str = 'squash') -> None:
-        # Parse GitHub PR URL to extract owner, repo, and PR number
-        parts = pr_url.rstrip('/').split('/')
-        if len(parts) < 7 or 'github.com' not in pr_url or 'pull' not in parts:
-            raise ValueError("Invalid GitHub PR URL format")
-        
-        owner = parts[-4]
-        repo = parts[-3]
-        pr_number = parts[-1]
+        owner, repo, pr_number = _parse_pr_url(pr_url)
         
         # Merge PR
         endpoint = f'repos/{owner}/{repo}/pulls/{pr_number}/merge'
@@ -123,42 +388,139 @@ class GitHubAPIClient:
 
 
 class PRMatcher:
-    def __init__(self, client: GitHubAPIClient):
+    def __init__(self, client: GitHubAPIClient, max_workers: int = 10,
+                 digest_cache: Optional[MutableMapping[str, bytes]] = None,
+                 prefetched: Optional[Dict[str, str]] = None,
+                 throttle: Optional[Throttle] = None):
         self.client = client
+        self.max_workers = max_workers
+        # Spaces out diff fetches across workers when the rate-limit budget is tight
+        self.throttle = throttle
+        # Diff digests keyed by PR URL and head SHA, reused across runs when persisted
+        self.digest_cache = digest_cache
+        # Diff texts already downloaded by the caller, keyed by PR URL
+        self.prefetched = prefetched or {}
     
-    def find_matching_prs(self, assigned_prs: List[Dict[str, Any]], example_diff: str) -> List[Dict[str, Any]]:
-        matching_prs = []
+    def find_matching_prs(self, assigned_prs: List[Dict[str, Any]], example_diff: str,
+                          example_pr: Optional[str] = None, max_matches: Optional[int] = None) -> List[Dict[str, Any]]:
+        if max_matches is not None and max_matches < 1:
+            raise ValueError("max_matches must be a positive integer")
         
-        def normalize_diff(diff_text: str) -> str:
-            """Remove only index lines from Git diff for comparison"""
-            lines = diff_text.strip().split('\n')
-            filtered_lines = []
-            
-            for i, line in enumerate(lines):
-                stripped_line = line.strip()
-                
-                # Skip index lines with various formats, but only if preceded by a diff header
-                if (stripped_line.startswith('index ') and '..' in stripped_line and
-                    i > 0 and lines[i-1].strip().startswith('diff --git ')):
-                    # Additional validation: ensure it looks like a git index line
-                    parts = stripped_line.split()
-                    if len(parts) >= 2 and '..' in parts[1]:
-                        continue
-                
-                filtered_lines.append(line)
+        example_digest = diff_digest(example_diff.split('\n'))
+        cache_keys: Dict[str, str] = {}
+        
+        if example_pr and assigned_prs:
+            summaries = self.client.get_pr_summaries([example_pr] + [pr['html_url'] for pr in assigned_prs])
+            assigned_prs = self._prefilter_by_file_stats(assigned_prs, summaries, example_pr)
             
-            return '\n'.join(filtered_lines)
+            # A PR's diff only changes when its head moves, so the head SHA keys the digest cache
+            for pr in assigned_prs:
+                head_sha = summaries[pr['html_url']]['head_sha']
+                if head_sha:
+                    cache_keys[pr['html_url']] = f"{DIGEST_VERSION}:{pr['html_url']}@{head_sha}"
         
-        normalized_example = normalize_diff(example_diff)
+        matching_urls = set()
+        pr_urls_to_fetch = []
         
         for pr in assigned_prs:
-            pr_diff = self.client.get_pr_diff(pr['html_url'])
-            normalized_pr_diff = normalize_diff(pr_diff)
+            pr_url = pr['html_url']
+            cache_key = cache_keys.get(pr_url)
+            
+            if self.digest_cache is not None and cache_key is not None and cache_key in self.digest_cache:
+                pr_digest = self.digest_cache[cache_key]
+            elif pr_url in self.prefetched:
+                pr_digest = diff_digest(self.prefetched[pr_url].split('\n'))
+                if self.digest_cache is not None and cache_key:
+                    self.digest_cache[cache_key] = pr_digest
+            else:
+                pr_urls_to_fetch.append(pr_url)
+                continue
             
-            if normalized_pr_diff == normalized_example:
-                matching_prs.append(pr)
+            if pr_digest == example_digest:
+                matching_urls.add(pr_url)
+        
+        # Diff fetches are network-bound, fan them out over a small worker pool.
+        # The pool size bounds in-flight requests to stay clear of GitHub's
+        # secondary rate limits; the shared session is safe to use across threads.
+        # Each worker streams its diff into a digest, so only fixed-size hashes are kept,
+        # and digests are compared as they complete so enough matches can end the search early.
+        if pr_urls_to_fetch and not (max_matches is not None and len(matching_urls) >= max_matches):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._fetch_diff_digest, pr_url): pr_url for pr_url in pr_urls_to_fetch}
+                
+                for future in as_completed(futures):
+                    pr_url = futures[future]
+                    pr_digest = future.result()
+                    
+                    if self.digest_cache is not None and pr_url in cache_keys:
+                        self.digest_cache[cache_keys[pr_url]] = pr_digest
+                    
+                    if pr_digest == example_digest:
+                        matching_urls.add(pr_url)
+                        if max_matches is not None and len(matching_urls) >= max_matches:
+                            for pending_future in futures:
+                                pending_future.cancel()
+                            break
+        
+        return [pr for pr in assigned_prs if pr['html_url'] in matching_urls][:max_matches]
+    
+    def _fetch_diff_digest(self, pr_url: str) -> bytes:
+        if self.throttle is not None:
+            self.throttle.wait()
+        return diff_digest(self.client.iter_pr_diff_lines(pr_url))
+    
+    def _prefilter_by_file_stats(self, assigned_prs: List[Dict[str, Any]], summaries: Dict[str, Dict[str, Any]],
+                                 example_pr: str) -> List[Dict[str, Any]]:
+        """Drop PRs whose changed files differ from the example PR's"""
+        example_stats = summaries[example_pr]['file_stats']
+        if example_stats is None:
+            return assigned_prs
         
-        return matching_prs
+        # Identical diffs always touch the same files with the same line counts,
+        # so only PRs that pass (or can't be checked) need their diff downloaded
+        return [pr for pr in assigned_prs
+                if summaries[pr['html_url']]['file_stats'] in (None, example_stats)]
+
+
+def schedule_from_rate_limit(rate_limit: Dict[str, Any], planned_requests: int, target_workers: int,
+                             min_interval: float = 0.0) -> Tuple[int, float]:
+    """Size a worker pool and the interval between requests to the remaining core budget"""
+    core = rate_limit['core']
+    remaining = core['remaining']
+    
+    workers = max(1, min(target_workers, remaining // 2))
+    if planned_requests <= remaining:
+        return workers, min_interval
+    
+    # Not enough budget for the whole batch: spread what's left until the limit resets
+    return workers, max(min_interval, (core['reset'] - time.time()) / max(remaining, 1))
+
+
+def positive_int(value: str) -> int:
+    """argparse type for options that only accept integers >= 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def flush_caches() -> None:
+    """Empty the on-disk HTTP and diff digest caches"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with CachedSession(HTTP_CACHE_PATH, backend='sqlite') as session:
+        session.cache.clear()
+    
+    # Flag 'n' always creates a new, empty database
+    shelve.open(DIGEST_CACHE_PATH, flag='n').close()
+
+
+def approve_and_merge(client: GitHubAPIClient, pr_url: str, throttle: Throttle) -> None:
+    """Approve and then merge a single PR, pacing each mutation through the shared throttle"""
+    throttle.wait()
+    client.approve_pr(pr_url)
+    
+    throttle.wait()
+    client.merge_pr(pr_url)
 
 
 def main():
@@ -178,80 +540,131 @@ def main():
         '--token',
         help='GitHub token (defaults to GITHUB_TOKEN environment variable)'
     )
+    parser.add_argument(
+        '--max-matches',
+        type=positive_int,
+        help='Stop searching once this many matching PRs are found'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Disable the on-disk HTTP and diff digest caches for this run'
+    )
+    parser.add_argument(
+        '--flush-cache',
+        action='store_true',
+        help='Clear the on-disk caches before running'
+    )
     parser.add_argument(
         'example_pr',
         help='Example PR URL to match diffs against'
     )
     
     args = parser.parse_args()
+    digest_cache = None
     
     try:
-        client = GitHubAPIClient(token=args.token)
-        
-        prs = client.search_assigned_prs(args.title_prefix, args.assignee)
-        
-        if not prs:
-            print(f"No PRs assigned to {args.assignee} with title starting with '{args.title_prefix}'")
-            return
-        
-        # Filter to only matching PRs
-        example_diff = client.get_pr_diff(args.example_pr)
-        
-        print("Example PR diff:")
-        print("-" * 60)
-        print(colorize_diff(example_diff))
-        print("-" * 60)
+        # Flushing applies to both caches even when they're not used for this run
+        if args.flush_cache:
+            flush_caches()
         
-        confirmation = input("Continue with this diff? (y/N): ").strip().lower()
-        if confirmation not in ['y', 'yes']:
-            print("Aborted.")
-            return
-        
-        print("Searching for matching PRs...")
-        matcher = PRMatcher(client)
-        prs = matcher.find_matching_prs(prs, example_diff)
-        
-        if not prs:
-            print(f"No PRs with matching diff found")
-            return
-        
-        print(f"Found {len(prs)} matching PRs:")
-        for pr in prs:
-            repo_owner, repo_name = pr['repository_url'].split('/')[-2:]
-            # Use ANSI escape sequence to create clickable hyperlink: \033]8;;URL\033\TEXT\033]8;;\033\
-            print(f"  \033]8;;{pr['html_url']}\033\\{repo_name} #{pr['number']}\033]8;;\033\\")
-        
-        # Process each PR with confirmation
-        auto_approve_all = False
-        
-        for pr in prs:
-            repo_owner, repo_name = pr['repository_url'].split('/')[-2:]
-            # Use ANSI escape sequence to create clickable hyperlink
-            print(f"\nProcess \033]8;;{pr['html_url']}\033\\{repo_name} #{pr['number']}\033]8;;\033\\?")
+        # The prefetch executor exits first, so its thread is joined before the session closes
+        with GitHubAPIClient(token=args.token, use_cache=not args.no_cache) as client, \
+                ThreadPoolExecutor(max_workers=1) as prefetcher:
+            if not args.no_cache:
+                digest_cache = shelve.open(DIGEST_CACHE_PATH)
             
-            if not auto_approve_all:
-                confirmation = input("Approve and merge? (y/N/s=stop/a=all): ").strip().lower()
-                
-                if confirmation == 's':
-                    print("Stopped processing.")
-                    break
-                elif confirmation == 'a':
-                    auto_approve_all = True
-                    print("Auto-approving all remaining PRs...")
-                elif confirmation not in ['y', 'yes']:
-                    print(f"Skipped {repo_name} #{pr['number']}")
-                    continue
+            # The example diff doesn't depend on the search, so fetch it in the background meanwhile
+            example_future = prefetcher.submit(client.get_pr_diff, args.example_pr)
             
-            try:
-                print(f"Approving {repo_name} #{pr['number']}...")
-                client.approve_pr(pr['html_url'])
+            prs = client.search_assigned_prs(args.title_prefix, args.assignee)
+            
+            if not prs:
+                example_future.cancel()
+                print(f"No PRs assigned to {args.assignee} with title starting with '{args.title_prefix}'")
+                return
+            
+            # Filter to only matching PRs
+            example_diff = example_future.result()
+            
+            print("Example PR diff:")
+            print("-" * 60)
+            print(colorize_diff(example_diff))
+            print("-" * 60)
+            
+            confirmation = input("Continue with this diff? (y/N): ").strip().lower()
+            if confirmation not in ['y', 'yes']:
+                print("Aborted.")
+                return
+            
+            # Size the diff fetches to the remaining budget
+            fetch_workers, fetch_interval = schedule_from_rate_limit(client.get_rate_limit(), len(prs), target_workers=10)
+            
+            print("Searching for matching PRs...")
+            # The example PR is often one of the candidates, so don't download its diff twice
+            owner, repo, pr_number = _parse_pr_url(args.example_pr)
+            prefetched = {f'https://github.com/{owner}/{repo}/pull/{pr_number}': example_diff}
+            matcher = PRMatcher(client, max_workers=fetch_workers, digest_cache=digest_cache, prefetched=prefetched,
+                                throttle=Throttle(fetch_interval))
+            prs = matcher.find_matching_prs(prs, example_diff, args.example_pr, max_matches=args.max_matches)
+            
+            if not prs:
+                print(f"No PRs with matching diff found")
+                return
+            
+            print(f"Found {len(prs)} matching PRs:")
+            for pr in prs:
+                repo_owner, repo_name = pr['repository_url'].split('/')[-2:]
+                # Use ANSI escape sequence to create clickable hyperlink: \033]8;;URL\033\TEXT\033]8;;\033\
+                print(f"  \033]8;;{pr['html_url']}\033\\{repo_name} #{pr['number']}\033]8;;\033\\")
+            
+            # Collect confirmations up front, then process the approved PRs in one concurrent pass
+            auto_approve_all = False
+            approved_prs = []
+            
+            for pr in prs:
+                repo_owner, repo_name = pr['repository_url'].split('/')[-2:]
+                # Use ANSI escape sequence to create clickable hyperlink
+                print(f"\nProcess \033]8;;{pr['html_url']}\033\\{repo_name} #{pr['number']}\033]8;;\033\\?")
+                
+                if not auto_approve_all:
+                    confirmation = input("Approve and merge? (y/N/s=stop/a=all): ").strip().lower()
+                    
+                    if confirmation == 's':
+                        print("Stopped processing.")
+                        break
+                    elif confirmation == 'a':
+                        auto_approve_all = True
+                        print("Auto-approving all remaining PRs...")
+                    elif confirmation not in ['y', 'yes']:
+                        print(f"Skipped {repo_name} #{pr['number']}")
+                        continue
                 
-                print(f"Merging {repo_name} #{pr['number']}...")
-                client.merge_pr(pr['html_url'])
+                approved_prs.append(pr)
+            
+            if not approved_prs:
+                return
+            
+            print(f"\nApproving and merging {len(approved_prs)} PRs...")
+            # Few workers and a minimum gap between mutations keep clear of GitHub's abuse detection.
+            # The diff fetches have spent budget since the last check, so ask again.
+            merge_workers, merge_interval = schedule_from_rate_limit(
+                client.get_rate_limit(), 2 * len(approved_prs), target_workers=5, min_interval=0.2
+            )
+            throttle = Throttle(merge_interval)
+            
+            with ThreadPoolExecutor(max_workers=merge_workers) as executor:
+                futures = {executor.submit(approve_and_merge, client, pr['html_url'], throttle): pr for pr in approved_prs}
                 
-                print(f"✓ Successfully processed {repo_name} #{pr['number']}")
-            except Exception as e:
-                print(f"✗ Failed to process {repo_name} #{pr['number']}: {e}")
+                for future in as_completed(futures):
+                    pr = futures[future]
+                    repo_owner, repo_name = pr['repository_url'].split('/')[-2:]
+                    
+                    try:
+                        future.result()
+                        print(f"✓ Successfully processed {repo_name} #{pr['number']}")
+                    except Exception as e:
+                        print(f"✗ Failed to process {repo_name} #{pr['number']}: {e}")
             
     except requests.exceptions.RequestException as e:
         print(f"API request failed: {e}")
@@ -259,6 +672,9 @@ def main():
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
+    finally:
+        if digest_cache is not None:
+            digest_cache.close()
 
 
 if __name__ == "__main__":